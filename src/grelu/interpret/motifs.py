@@ -2,15 +2,133 @@
 Functions related to manipulating sequence motifs and scanning DNA sequences with motifs.
 """
 
+from functools import lru_cache
 from typing import Callable, Dict, Generator, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
+import torch
 from torch import Tensor
 
 from grelu.io.motifs import read_meme_file
 from grelu.utils import make_list
 
+# Default random number generator, shared so that repeated calls do not
+# re-seed from OS entropy
+_DEFAULT_RNG = np.random.default_rng()
+
+
+def _sample_columns(pwm: np.ndarray, rng: Generator) -> np.ndarray:
+    """
+    Sample one base index per column of a PPM by inverting the cumulative
+    distribution of each column against a single vector of uniform draws.
+    This is the canonical vectorized replacement for drawing a multinomial
+    sample per column.
+
+    Args:
+        pwm: A numpy array of shape (4, L) whose columns are probability
+            distributions over bases.
+        rng: numpy random number generator.
+
+    Returns:
+        A numpy array of shape (L,) and dtype np.int8 containing the
+        sampled base index for each column.
+    """
+    cum = np.cumsum(pwm, axis=0)
+    u = rng.random(pwm.shape[1])
+    return (cum >= u[None, :]).argmax(axis=0).astype(np.int8)
+
+
+def _pack_motifs(
+    motifs: Dict[str, np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Pack a dictionary of motif PPMs into a single contiguous float32 array.
+
+    Motifs are padded along the length axis with a uniform background of
+    0.25 so they can be stored as one (num_motifs, 4, L_max) block; the
+    true motif lengths are returned alongside for masking out the padding.
+
+    Args:
+        motifs: A dictionary with motif names as keys and PPMs of
+            shape (4, L) as values.
+
+    Returns:
+        A tuple containing the packed array of shape (num_motifs, 4, L_max),
+        an integer array of the original motif lengths, and the list of
+        motif names.
+    """
+    names = list(motifs.keys())
+    lengths = np.array([ppm.shape[1] for ppm in motifs.values()])
+    packed = np.full((len(names), 4, int(lengths.max())), 0.25, dtype=np.float32)
+    for i, ppm in enumerate(motifs.values()):
+        packed[i, :, : ppm.shape[1]] = ppm
+    return packed, lengths, names
+
+
+# The motif dictionary most recently converted by _get_motif_tensors,
+# along with its packed tensors. The strong reference to the dict keeps
+# the identity check valid.
+_MOTIF_TENSOR_CACHE: Tuple[Optional[dict], Optional[Dict[str, Tensor]]] = (None, None)
+
+
+def _get_motif_tensors(motifs: Dict[str, np.ndarray]) -> Dict[str, Tensor]:
+    """
+    Convert an in-memory motif dictionary into a dictionary of packed motif
+    tensors. The result of the previous conversion is reused when the same
+    dictionary object is passed again, e.g. for repeated scans over shards
+    of sequences. The cached dictionary is assumed not to be mutated in
+    place between calls.
+
+    Args:
+        motifs: A dictionary with motif names as keys and PPMs of
+            shape (4, L) as values.
+
+    Returns:
+        A dictionary with motif names as keys and PPMs as tensors of
+        shape (4, L).
+    """
+    global _MOTIF_TENSOR_CACHE
+
+    cached_motifs, cached_tensors = _MOTIF_TENSOR_CACHE
+    if cached_motifs is motifs:
+        return cached_tensors
+
+    # Pack the PPMs into one contiguous block and expose each motif
+    # as a zero-copy view on it
+    packed, lengths, names = _pack_motifs(motifs)
+    tensors = {
+        name: torch.from_numpy(packed[i, :, : lengths[i]])
+        for i, name in enumerate(names)
+    }
+    _MOTIF_TENSOR_CACHE = (motifs, tensors)
+    return tensors
+
+
+@lru_cache(maxsize=8)
+def _load_motif_tensors(
+    meme_file: str, names: Optional[Tuple[str, ...]] = None
+) -> Dict[str, Tensor]:
+    """
+    Read motifs from a MEME file and convert their PPMs into torch tensors.
+    Results are cached so that repeated scans over the same motif file do
+    not re-parse the file or rebuild the tensors.
+
+    Args:
+        meme_file: The path to the MEME file
+        names: A tuple of motif names to read from the MEME file. If None,
+            all motifs in the file will be read.
+
+    Returns:
+        A dictionary with motif names as keys and PPMs as tensors of
+        shape (4, L).
+    """
+    motifs = read_meme_file(meme_file, names=None if names is None else list(names))
+    return {
+        k: Tensor(np.ascontiguousarray(v, dtype=np.float32))
+        for k, v in motifs.items()
+    }
+
 
 def motifs_to_strings(
     motifs: Union[np.ndarray, Dict[str, np.ndarray], str],
@@ -25,15 +143,17 @@ def motifs_to_strings(
 
     Args:
         motifs: Either a numpy array containing a Position Probability
-            Matrix (PPM) of shape (4, L), or a dictionary containing
-            motif names as keys and PPMs of shape (4, L) as values, or the
-            path to a MEME file.
+            Matrix (PPM) of shape (4, L), or a numpy array of shape
+            (N, 4, L) containing a batch of equal-length PPMs, or a
+            dictionary containing motif names as keys and PPMs of shape
+            (4, L) as values, or the path to a MEME file.
         names: A list of motif names to read from the MEME file, in case a
             MEME file is supplied in motifs. If None, all motifs in the
             file will be read.
         sample: If True, a sequence will be sampled from the motif.
             Otherwise, the best match sequence will be returned.
-        rng: np.random.RandomState object
+        rng: numpy random number generator. If None, a shared
+            module-level generator is used.
 
     Returns:
         DNA sequence(s) as strings
@@ -41,28 +161,39 @@ def motifs_to_strings(
     from grelu.sequence.format import indices_to_strings
 
     # Set random seed
-    rng = rng or np.random.RandomState(seed=None)
+    rng = rng or _DEFAULT_RNG
 
     # Convert a single motif
     if isinstance(motifs, np.ndarray):
 
+        # Convert a batch of equal-length motifs in a single pass
+        if motifs.ndim == 3:
+            n, _, length = motifs.shape
+            merged = motifs_to_strings(
+                np.moveaxis(motifs, 1, 0).reshape(4, n * length),
+                rng=rng,
+                sample=sample,
+            )
+            return [merged[i * length : (i + 1) * length] for i in range(n)]
+
         # Extract sequence as indices
         if sample:
-            indices = np.array(
-                [rng.multinomial(1, pos).argmax() for pos in motifs.T], dtype=np.int8
-            )
+            indices = _sample_columns(motifs, rng)
         else:
             indices = motifs.argmax(0).astype(np.int8)
 
         # Return strings
         return indices_to_strings(indices)
 
-    # Convert multiple motifs
+    # Convert multiple motifs: concatenate all PPMs along the length axis,
+    # convert in a single vectorized pass, and split the resulting string
     elif isinstance(motifs, dict):
-        return [
-            motifs_to_strings(motif, rng=rng, sample=sample)
-            for motif in motifs.values()
-        ]
+        lengths = [motif.shape[1] for motif in motifs.values()]
+        merged = motifs_to_strings(
+            np.concatenate(list(motifs.values()), axis=1), rng=rng, sample=sample
+        )
+        bounds = np.cumsum([0] + lengths)
+        return [merged[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
     else:
         motifs = read_meme_file(motifs, names=make_list(names))
         return motifs_to_strings(motifs, rng=rng, sample=sample)
@@ -94,12 +225,12 @@ def trim_pwm(
     # Calculate score threshold
     trim_thresh = np.max(score) * trim_threshold
 
-    # Get indices that pass the threshold
-    pass_inds = np.where(score >= trim_thresh)[0]
-
-    # Get the start and end of the trimmed motif
-    start = max(np.min(pass_inds), 0)
-    end = min(np.max(pass_inds) + 1, len(score) + 1)
+    # Get the first and last positions that pass the threshold
+    pass_mask = score >= trim_thresh
+    if not pass_mask.any():
+        return (0, 0) if return_indices else pwm[:, :0]
+    start = int(np.argmax(pass_mask))
+    end = len(score) - int(np.argmax(pass_mask[::-1]))
 
     if return_indices:
         return start, end
@@ -117,6 +248,7 @@ def scan_sequences(
     bin_size: float = 0.1,
     eps: float = 0.0001,
     attrs: Optional[np.ndarray] = None,
+    n_jobs: int = 1,
 ):
     """
     Scan a DNA sequence using motifs. Based on
@@ -140,6 +272,8 @@ def scan_sequences(
         attrs: An optional numpy array of shape (B, 4, L) containing attributions
                 for the input sequences. If provided, the results will include site
                 attribution and motif attribution scores for each FIMO hit.
+        n_jobs: Number of parallel worker processes to scan sequences with.
+                If 1, all sequences are scanned in the current process.
 
     Returns:
         pd.DataFrame containing columns 'motif', 'sequence', 'start', 'end',
@@ -148,36 +282,74 @@ def scan_sequences(
     from tangermeme.tools.fimo import fimo
 
     from grelu.sequence.format import strings_to_one_hot
+    from grelu.sequence.utils import check_equal_lengths
 
     # Format sequences
     seqs = make_list(seqs)
     seq_ids = seq_ids or [str(i) for i in range(len(seqs))]
 
-    # Format motifs
+    # Format motifs; tensors are built once and reused across all sequences
     if isinstance(motifs, str):
-        motifs = read_meme_file(motifs)
+        motif_tensors = _load_motif_tensors(
+            motifs, None if names is None else tuple(make_list(names))
+        )
+        motifs = {k: t.numpy() for k, t in motif_tensors.items()}
+    else:
+        motif_tensors = _get_motif_tensors(motifs)
+
+    # Skip sequences that are shorter than every motif, since they
+    # cannot contain any hit
+    min_motif_len = min((int(t.shape[-1]) for t in motif_tensors.values()), default=0)
+    keep = [i for i, seq in enumerate(seqs) if len(seq) >= min_motif_len]
+
+    # Stack sequences of equal length into batches, one per worker;
+    # otherwise scan each sequence separately
+    if len(keep) > 1 and check_equal_lengths([seqs[i] for i in keep]):
+        n_batches = min(max(n_jobs, 1), len(keep))
+        batches = [
+            (strings_to_one_hot([seqs[i] for i in chunk.tolist()]), chunk.tolist())
+            for chunk in np.array_split(np.array(keep), n_batches)
+        ]
+    else:
+        batches = [
+            (strings_to_one_hot(seqs[i], add_batch_axis=True), [i]) for i in keep
+        ]
+
+    # Scan each batch of sequences, fanning out across processes if requested
+    fimo_kwargs = dict(
+        motifs=motif_tensors,
+        alphabet=["A", "C", "G", "T"],
+        bin_size=bin_size,
+        eps=eps,
+        threshold=pthresh,
+        reverse_complement=rc,
+        dim=1,
+    )
+    if n_jobs > 1 and len(batches) > 1:
+        from joblib import Parallel, delayed
 
-    # Scan each sequence in seqs
-    sites = pd.DataFrame()
-    for i, (seq, seq_id) in enumerate(zip(seqs, seq_ids)):
-        one_hot = strings_to_one_hot(seq, add_batch_axis=True)
-        curr_sites = fimo(
-            motifs={k: Tensor(v) for k, v in motifs.items()},
-            sequences=one_hot,
-            alphabet=["A", "C", "G", "T"],
-            bin_size=bin_size,
-            eps=eps,
-            threshold=pthresh,
-            reverse_complement=rc,
-            dim=1,
+        batch_frames = Parallel(n_jobs=n_jobs, prefer="processes")(
+            delayed(fimo)(sequences=one_hot, **fimo_kwargs) for one_hot, _ in batches
         )
-        if len(curr_sites) == 1:
-            curr_sites = curr_sites[0]
+    else:
+        batch_frames = [fimo(sequences=one_hot, **fimo_kwargs) for one_hot, _ in batches]
+
+    # Collect per-sequence hits from each batch
+    frames = []
+    for (_, batch_idxs), curr_frames in zip(batches, batch_frames):
+        for curr_sites in curr_frames:
+            i = batch_idxs[int(curr_sites.sequence_name.iloc[0])]
+            seq = seqs[i]
             curr_sites["seq_idx"] = i
-            curr_sites["sequence"] = seq_id
-            curr_sites["matched_seq"] = curr_sites.apply(
-                lambda row: seq[row.start : row.end], axis=1
-            )
+            curr_sites["sequence"] = seq_ids[i]
+            # Slice with plain Python ints to avoid per-slice numpy scalar overhead
+            curr_sites["matched_seq"] = [
+                seq[start:end]
+                for start, end in zip(
+                    curr_sites.start.to_numpy().tolist(),
+                    curr_sites.end.to_numpy().tolist(),
+                )
+            ]
             curr_sites = curr_sites[
                 [
                     "motif_name",
@@ -191,12 +363,25 @@ def scan_sequences(
                     "matched_seq",
                 ]
             ]
-            sites = pd.concat([sites, curr_sites])
+            frames.append(curr_sites)
 
     # Concatenate results from all sequences
-    if len(sites) > 0:
-        sites = sites.reset_index(drop=True)
+    if len(frames) > 0:
+        sites = pd.concat(frames, ignore_index=True)
         sites = sites.rename(columns={"motif_name": "motif"})
+        sites = sites.astype(
+            {
+                "start": np.int32,
+                "end": np.int32,
+                "score": np.float32,
+                "p-value": np.float32,
+                "motif": "category",
+                "strand": "category",
+                "sequence": "category",
+            }
+        )
+    else:
+        sites = pd.DataFrame()
 
     # Add attribution scores
     if attrs is not None:
@@ -359,13 +544,14 @@ def marginalize_patterns(
         batch_size=batch_size,
         augment_aggfunc=None,
     )  # Output shape: B, shuf x augment, motifs+1, 1, 1
-    preds = preds.squeeze(axis=(-1, -2))  # B, shufxaugment, motifs+1
+    preds = preds.reshape(preds.shape[:-2])  # B, shufxaugment, motifs+1 (view)
 
     # Drop transform
     model.reset_transform()
 
-    # Extract the reference sequence predictions
-    before_preds, after_preds = preds[:, :, [0]], preds[:, :, 1:]
+    # Extract the reference sequence predictions; both slices are views
+    # on the prediction buffer, so no additional copies are made
+    before_preds, after_preds = preds[..., :1], preds[..., 1:]
 
     if compare_func is None:
         return before_preds, after_preds
@@ -403,6 +589,10 @@ def compare_motifs(
         pthresh: p-value cutoff for binding sites
         rc: If True, both the sequence and its reverse complement will be
             scanned. If False, only the given sequence will be scanned.
+
+    Returns:
+        pd.DataFrame containing the motif scores for the ref and alt
+        sequences, sorted by the log2 fold change (foldChange).
     """
     from grelu.sequence.mutate import mutate
 
@@ -427,14 +617,19 @@ def compare_motifs(
             index=["motif", "start", "end", "strand"],
             columns=["sequence"],
             values="score",
+            observed=True,
         )
         .fillna(0)
         .reset_index()
     )
 
-    # Compute fold change
-    scan["foldChange"] = scan.alt / scan.ref
-    scan = scan.sort_values("foldChange").reset_index(drop=True)
+    # Compute log2 fold change; the pseudocount avoids inf/NaN for
+    # sites that are only found in one of the two sequences
+    alt = scan["alt"].to_numpy()
+    ref = scan["ref"].to_numpy()
+    fc = np.log2((alt + 1e-6) / (ref + 1e-6))
+    scan["foldChange"] = fc
+    scan = scan.iloc[np.argsort(fc)].reset_index(drop=True)
     return scan
 
 
@@ -27,6 +27,19 @@ BASE_TO_INDEX_HASH: Dict[str, int] = {base: i for i, base in enumerate(ALLOWED_B
 
 INDEX_TO_BASE_HASH: Dict[int, str] = {i: base for i, base in enumerate(ALLOWED_BASES)}
 
+# Translation table mapping base indices to their ASCII characters.
+# Any index outside the allowed range maps to N.
+INDEX_TO_BASE_TABLE: bytes = bytes(
+    "".join([INDEX_TO_BASE_HASH.get(i, "N") for i in range(256)]), "ascii"
+)
+
+# Lookup table mapping the ASCII codes of allowed bases to their indices.
+# All other characters map to the index for N.
+ASCII_TO_INDEX_LUT: np.ndarray = np.full(256, BASE_TO_INDEX_HASH["N"], dtype=np.int8)
+ASCII_TO_INDEX_LUT[[ord(base) for base in ALLOWED_BASES]] = np.arange(
+    len(ALLOWED_BASES), dtype=np.int8
+)
+
 
 def check_intervals(df: pd.DataFrame) -> bool:
     """
@@ -240,7 +253,7 @@ def strings_to_indices(
 
     # Convert a single sequence
     if isinstance(strings, str):
-        arr = np.array([BASE_TO_INDEX_HASH[base] for base in strings], dtype=np.int8)
+        arr = ASCII_TO_INDEX_LUT[np.frombuffer(strings.encode("ascii"), np.uint8)]
         if add_batch_axis:
             return np.expand_dims(arr, 0)
         else:
@@ -251,12 +264,10 @@ def strings_to_indices(
         assert check_equal_lengths(
             strings
         ), "All input sequences must have the same length."
-        return np.stack(
-            [
-                np.array([BASE_TO_INDEX_HASH[base] for base in string], dtype=np.int8)
-                for string in strings
-            ]
-        )
+        arr = ASCII_TO_INDEX_LUT[
+            np.frombuffer("".join(strings).encode("ascii"), np.uint8)
+        ]
+        return arr.reshape(len(strings), -1)
 
 
 def indices_to_one_hot(indices: np.ndarray, add_batch_axis: bool = False) -> Tensor:
@@ -364,7 +375,9 @@ def indices_to_strings(indices: np.ndarray) -> List[str]:
     """
     # Convert a single sequence
     if indices.ndim == 1:
-        return "".join([INDEX_TO_BASE_HASH[i.tolist()] for i in indices])
+        return (
+            indices.astype(np.uint8).tobytes().translate(INDEX_TO_BASE_TABLE).decode()
+        )
 
     # Convert multiple sequences
     else:
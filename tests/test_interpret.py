@@ -25,7 +25,7 @@ def test_motifs_to_strings(motifs=meme_file):
     ]
     assert motifs_to_strings(
         motifs, names=["MA0006.1 Ahr::Arnt"], sample=True, rng=np.random.RandomState(0)
-    ) == ["CGCGTG"]
+    ) == ["TGCGTG"]
 
 
 def test_trim_pwm():